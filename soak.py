@@ -0,0 +1,382 @@
+# Uzoq muddatli "soak" test: resurs oqishlarini aniqlash
+#
+# Bot API va yt-dlp o'rniga oflayn soxta (fake) obyektlar ishlatiladi, shuning
+# uchun internet va token kerak emas. Minglab aralash joblar (muvaffaqiyatli,
+# xatolik, juda katta fayl, yuborishda xatolik, bekor qilish, muddat tugashi,
+# navbatda turganda bekor qilish)
+# handle_callback orqali o'tkaziladi va RSS, ochiq fayl deskriptorlari,
+# vaqtinchalik papkalar, threadlar soni hamda tracemalloc xotirasi kuzatiladi.
+#
+# Foydalanish:
+#   python soak.py --jobs 20000 --concurrency 32
+#
+# Biron ko'rsatkich chegaradan oshsa, dastur 1 kodi bilan tugaydi.
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import yt_dlp
+from telegram.error import NetworkError
+
+import yuklabot
+
+JOB_KINDS = [
+    'success', 'failure', 'oversized', 'too_large', 'send_error',
+    'cancelled', 'timeout', 'queued_cancel'
+]
+
+# Muddat tugashini tez sinash uchun alohida platforma/sifat
+TIMEOUT_PLATFORM = 'instagram'
+TIMEOUT_QUALITY = 'low'
+TIMEOUT_SECONDS = 0.05
+
+# Sekin joblar (bekor qilish / muddat) progress hook ni shuncha marta chaqiradi
+SLOW_JOB_STEPS = 200
+SLOW_JOB_STEP_DELAY = 0.005
+
+# Extraction bosqichi (progress hook chaqirilmaydi) davomiyligi
+SLOW_EXTRACT_DELAY = 0.05
+
+# Navbatda bekor qilingan joblar extract_info ga yetib kelmasligi kerak
+fake_stats = {'queued_cancel_extractions': 0}
+fake_stats_lock = threading.Lock()
+
+
+# Soxta yt-dlp: URL dagi "kind" ga qarab o'zini tutadi
+class FakeYoutubeDL:
+    def __init__(self, params):
+        self.params = params
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def _hook(self, data):
+        for hook in self.params.get('progress_hooks', []):
+            hook(data)
+
+    def extract_info(self, url, download=True):
+        kind = url.rsplit('kind=', 1)[1]
+
+        if kind == 'failure':
+            raise yt_dlp.utils.DownloadError('ERROR: soak: video topilmadi')
+
+        if kind == 'queued_cancel':
+            # Bu job faqat navbatda bekor qilinadi - bu yerga kelmasligi kerak
+            with fake_stats_lock:
+                fake_stats['queued_cancel_extractions'] += 1
+            time.sleep(SLOW_EXTRACT_DELAY)
+
+        info = {'title': kind, 'ext': 'mp4', 'duration': 1, 'webpage_url': url}
+        return self.process_ie_result(info, download=True) if download else info
+
+    def process_ie_result(self, info, download=True):
+        kind = info['title']
+
+        if kind == 'too_large':
+            self._hook({'status': 'downloading', 'downloaded_bytes': 0,
+                        'total_bytes': yuklabot.MAX_FILE_SIZE + 1})
+
+        if kind in ('cancelled', 'timeout'):
+            for step in range(SLOW_JOB_STEPS):
+                time.sleep(SLOW_JOB_STEP_DELAY)
+                self._hook({'status': 'downloading', 'downloaded_bytes': step})
+
+        with open(self.prepare_filename(info), 'wb') as f:
+            if kind == 'oversized':
+                # Sparse fayl: diskka yozilmaydi, lekin hajmi 50MB dan katta
+                f.truncate(yuklabot.MAX_FILE_SIZE + 1)
+            else:
+                f.write(b'\0' * 1024)
+
+        self._hook({'status': 'finished', 'downloaded_bytes': 1024})
+        return info
+
+    def prepare_filename(self, info):
+        return self.params['outtmpl'] % info
+
+
+# Soxta Bot API obyektlari
+class FakeMessage:
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text, **kwargs):
+        return self
+
+    async def delete(self):
+        return True
+
+
+class FakeBot:
+    username = 'yukla_soak_bot'
+
+    async def send_video(self, chat_id, video, caption=None, **kwargs):
+        video.read()
+        if 'send_error' in caption:
+            raise NetworkError('soak: yuborishda xatolik')
+        return FakeMessage(chat_id, 0)
+
+
+class FakeQuery:
+    def __init__(self, data, user_id, message):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text, **kwargs):
+        return self.message
+
+
+def make_update(data, user_id, message):
+    return SimpleNamespace(callback_query=FakeQuery(data, user_id, message))
+
+
+# Barcha download workerlarni band qilish: shu vaqtda yuborilgan job navbatda qoladi
+async def hold_download_workers():
+    release = threading.Event()
+    running = threading.Barrier(yuklabot.DOWNLOAD_WORKERS + 1)
+
+    def _hold():
+        running.wait()
+        release.wait()
+
+    loop = asyncio.get_event_loop()
+    holders = [
+        loop.run_in_executor(yuklabot.executor, _hold) for _ in range(yuklabot.DOWNLOAD_WORKERS)
+    ]
+    await loop.run_in_executor(None, running.wait)
+    return release, holders
+
+
+# Bitta jobni handle_callback orqali o'tkazish
+async def run_job(context, job_number, kind, hold_lock):
+    user_id = 1000 + job_number % 50
+    message = FakeMessage(user_id, job_number)
+
+    if kind == 'timeout':
+        url = f"https://www.instagram.com/reel/soak{job_number}?kind={kind}"
+        quality = TIMEOUT_QUALITY
+    else:
+        url = f"https://www.tiktok.com/@soak/video/{job_number}?kind={kind}"
+        quality = 'high'
+
+    job_id = f"{message.chat_id}_{message.message_id}"
+
+    async def start_and_cancel():
+        task = asyncio.ensure_future(
+            yuklabot.handle_callback(make_update(f"dl_{quality}_{url}", user_id, message), context)
+        )
+        while job_id not in yuklabot.active_downloads and not task.done():
+            await asyncio.sleep(SLOW_JOB_STEP_DELAY)
+        await yuklabot.handle_callback(make_update(f"cancel_{job_id}", user_id, message), context)
+        return task
+
+    if kind == 'queued_cancel':
+        # Workerlar band bo'lganda navbatga qo'yib, o'sha yerda bekor qilamiz
+        async with hold_lock:
+            release, holders = await hold_download_workers()
+            try:
+                task = await start_and_cancel()
+            finally:
+                release.set()
+                await asyncio.gather(*holders)
+    elif kind == 'cancelled':
+        task = await start_and_cancel()
+    else:
+        task = asyncio.ensure_future(
+            yuklabot.handle_callback(make_update(f"dl_{quality}_{url}", user_id, message), context)
+        )
+
+    await task
+
+
+# Ko'rsatkichlarni o'lchash
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # /proc yo'q bo'lsa (macOS) - eng yuqori RSS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def open_fd_count():
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return 0
+
+
+def take_sample(jobs_done, temp_root):
+    traced_current, _ = tracemalloc.get_traced_memory()
+    return {
+        'jobs': jobs_done,
+        'rss': rss_bytes(),
+        'fds': open_fd_count(),
+        'tempdirs': len(os.listdir(temp_root)),
+        'threads': threading.active_count(),
+        'traced': traced_current,
+        'active_jobs': len(yuklabot.active_downloads),
+        'queued_extractions': fake_stats['queued_cancel_extractions'],
+    }
+
+
+def print_sample(sample):
+    print(
+        f"{sample['jobs']:>8} joblar | RSS {sample['rss'] / 1024 / 1024:7.1f}MB | "
+        f"fd {sample['fds']:4} | temp {sample['tempdirs']:5} | "
+        f"thread {sample['threads']:3} | traced {sample['traced'] / 1024 / 1024:6.1f}MB | "
+        f"faol {sample['active_jobs']} | navbat leak {sample['queued_extractions']}"
+    )
+
+
+# Asosiy soak sikli
+async def soak(args, temp_root):
+    context = SimpleNamespace(bot=FakeBot())
+    kinds = itertools.cycle(JOB_KINDS)
+    job_numbers = itertools.count()
+    hold_lock = asyncio.Lock()
+
+    async def run_batch(count):
+        done = 0
+        while done < count:
+            size = min(args.concurrency, count - done)
+            await asyncio.gather(*[
+                run_job(context, next(job_numbers), next(kinds), hold_lock) for _ in range(size)
+            ])
+            done += size
+
+        # Bekor qilingan/muddati o'tgan threadlar tugashini kutish: har bir
+        # worker barrier ga yetib kelsa, oldingi ishlarning hammasi tugagan
+        workers = yuklabot.DOWNLOAD_WORKERS
+        barrier = threading.Barrier(workers)
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(yuklabot.executor, barrier.wait) for _ in range(workers)
+        ])
+
+    # Isinish: thread pool lar va keshlar to'lishi uchun
+    await run_batch(args.warmup)
+    tracemalloc.start(args.traceback_depth)
+    baseline_snapshot = tracemalloc.take_snapshot()
+    baseline = take_sample(0, temp_root)
+    print_sample(baseline)
+
+    samples = [baseline]
+    jobs_done = 0
+    while jobs_done < args.jobs:
+        count = min(args.sample_every, args.jobs - jobs_done)
+        await run_batch(count)
+        jobs_done += count
+        sample = take_sample(jobs_done, temp_root)
+        samples.append(sample)
+        print_sample(sample)
+
+    final_snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    return samples, final_snapshot.compare_to(baseline_snapshot, 'lineno')
+
+
+def check_thresholds(args, samples):
+    baseline, last = samples[0], samples[-1]
+    limits = [
+        ('RSS (MB)', (last['rss'] - baseline['rss']) / 1024 / 1024, args.max_rss_growth_mb),
+        ('ochiq fd', last['fds'] - baseline['fds'], args.max_fd_growth),
+        ('vaqtinchalik papkalar', last['tempdirs'] - baseline['tempdirs'], args.max_tempdir_growth),
+        ('threadlar', last['threads'] - baseline['threads'], args.max_thread_growth),
+        ('tracemalloc (MB)', (last['traced'] - baseline['traced']) / 1024 / 1024, args.max_traced_growth_mb),
+        ('faol joblar', last['active_jobs'], 0),
+        ('navbatdan extraction', last['queued_extractions'], args.max_queued_extractions),
+    ]
+
+    failures = []
+    for name, growth, limit in limits:
+        status = 'OK' if growth <= limit else 'OSHDI'
+        print(f"  {name:<22} o'sish {growth:>9.2f} / chegara {limit:<8} {status}")
+        if growth > limit:
+            failures.append(name)
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Yukla bot uchun resurs oqishi soak testi")
+    parser.add_argument('--jobs', type=int, default=20000, help="jami joblar soni")
+    parser.add_argument('--concurrency', type=int, default=32, help="bir vaqtda ishlaydigan joblar")
+    parser.add_argument('--warmup', type=int, default=500, help="o'lchovdan oldingi joblar")
+    parser.add_argument('--sample-every', type=int, default=1000, help="har necha jobda o'lchash")
+    parser.add_argument('--top', type=int, default=10, help="tracemalloc top allokatorlar soni")
+    parser.add_argument('--traceback-depth', type=int, default=1, help="tracemalloc stek chuqurligi")
+    parser.add_argument('--max-rss-growth-mb', type=float, default=50)
+    parser.add_argument('--max-fd-growth', type=int, default=5)
+    parser.add_argument('--max-tempdir-growth', type=int, default=0)
+    parser.add_argument('--max-thread-growth', type=int, default=2)
+    parser.add_argument('--max-traced-growth-mb', type=float, default=10)
+    parser.add_argument('--max-queued-extractions', type=int, default=0,
+                        help="navbatda bekor qilingan, lekin extract_info ga yetgan joblar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger(yuklabot.__name__).setLevel(logging.WARNING)
+
+    work_dir = tempfile.mkdtemp(prefix='yukla-soak-')
+    temp_root = os.path.join(work_dir, 'tmp')
+    os.mkdir(temp_root)
+
+    # Bot vaqtinchalik fayllari va bazasi alohida joyda bo'lsin
+    tempfile.tempdir = temp_root
+    yuklabot.DATABASE_PATH = os.path.join(work_dir, 'soak.db')
+    yuklabot.DOWNLOAD_TIMEOUTS[TIMEOUT_PLATFORM] = {TIMEOUT_QUALITY: TIMEOUT_SECONDS}
+    yuklabot.yt_dlp.YoutubeDL = FakeYoutubeDL
+    yuklabot.init_database()
+
+    try:
+        started = time.monotonic()
+        samples, top_stats = asyncio.run(soak(args, temp_root))
+        print(f"\n⏱ {time.monotonic() - started:.1f} soniya, "
+              f"bekor qilingan: {yuklabot.download_counters['cancelled']}, "
+              f"vaqti tugagan: {yuklabot.download_counters['timed_out']}")
+
+        print(f"\n📈 tracemalloc top {args.top} (isinishdan keyin o'sish):")
+        for stat in top_stats[:args.top]:
+            print(f"  {stat}")
+
+        print("\n📊 Chegaralar:")
+        failures = check_thresholds(args, samples)
+    finally:
+        tempfile.tempdir = None
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"\n❌ Resurs oqishi: {', '.join(failures)}")
+        return 1
+
+    print("\n✅ Oqish aniqlanmadi")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,6 +17,8 @@ from functools import lru_cache
 import tempfile
 import shutil
 from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
 
 # Logging sozlamalari
 logging.basicConfig(
@@ -32,7 +34,26 @@ PORT = 8080
 ADMIN_IDS = [6852738257]
 DATABASE_PATH = "bot_database.db"
 # Thread pool for downloading
-executor = ThreadPoolExecutor(max_workers=3)
+DOWNLOAD_WORKERS = 3
+executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+
+# Telegram orqali yuboriladigan maksimal fayl hajmi
+MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+
+# Yuklab olish muddatlari (soniya): platforma -> sifat -> muddat
+DEFAULT_DOWNLOAD_TIMEOUT = 180
+DOWNLOAD_TIMEOUTS = {
+    'youtube': {'720': 300, '480': 240, '360': 180, 'audio': 120},
+    'tiktok': {'high': 90, 'medium': 60, 'low': 60},
+    'instagram': {'high': 120, 'medium': 90, 'low': 90},
+    'facebook': {'high': 180, 'medium': 120, 'low': 120},
+}
+
+# Faol yuklab olishlar: job_id -> job
+active_downloads = {}
+
+# Bekor qilingan va muddati o'tgan yuklab olishlar hisoblagichi
+download_counters = {'cancelled': 0, 'timed_out': 0}
 
 # Ma'lumotlar bazasini yaratish
 def init_database():
@@ -232,9 +253,71 @@ def get_quality_keyboard(platform, url):
     
     return InlineKeyboardMarkup(keyboard)
 
+# Yuklab olish muddatini aniqlash
+def get_download_timeout(platform, quality):
+    return DOWNLOAD_TIMEOUTS.get(platform, {}).get(quality, DEFAULT_DOWNLOAD_TIMEOUT)
+
+# Yangi yuklab olish jobini ro'yxatga olish
+def create_download_job(job_id, user_id, timeout):
+    job = {
+        'id': job_id,
+        'user_id': user_id,
+        'timeout': timeout,
+        'deadline': None,            # worker slot olganda boshlanadi
+        'abort': threading.Event(),  # yt-dlp thread uchun
+        'wakeup': asyncio.Event(),   # kutayotgan handler uchun
+        'started': asyncio.Event(),  # job worker slot oldi
+        'lock': threading.Lock(),    # 'reason' ni thread va event loop birga yozadi
+        'reason': None
+    }
+    active_downloads[job_id] = job
+    return job
+
+# To'xtatish sababini belgilash (thread-safe): birinchi sabab saqlanadi
+def mark_download_aborted(job, reason):
+    with job['lock']:
+        if job['reason'] is None:
+            job['reason'] = reason
+        job['abort'].set()
+
+# Yuklab olishni to'xtatish (bekor qilish yoki muddat tugashi)
+def abort_download(job, reason):
+    mark_download_aborted(job, reason)
+    job['wakeup'].set()
+
 # Optimallashtirilgan video yuklab olish
-async def download_video(url, quality='best'):
+async def download_video(url, quality='best', job=None):
+    def _progress_hook(d):
+        # Har bir yuklangan bo'lakdan keyin chaqiriladi - shu yerda to'xtatamiz
+        if job is None:
+            return
+        if not job['abort'].is_set():
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            if time.monotonic() > job['deadline']:
+                mark_download_aborted(job, 'timeout')
+            elif total > MAX_FILE_SIZE or d.get('downloaded_bytes', 0) > MAX_FILE_SIZE:
+                mark_download_aborted(job, 'too_large')
+        if job['abort'].is_set():
+            raise yt_dlp.utils.DownloadCancelled(job['reason'])
+
+    def _aborted_result():
+        return {
+            'success': False,
+            'reason': job['reason'],
+            'error': job['reason']
+        }
+
     def _download():
+        if job is not None:
+            # Navbatda turganda bekor qilingan job slotni band qilmaydi
+            if job['abort'].is_set():
+                return _aborted_result()
+            
+            # Muddat navbatda kutgan vaqtni emas, yuklab olishni o'lchaydi
+            job['deadline'] = time.monotonic() + job['timeout']
+            loop.call_soon_threadsafe(job['started'].set)
+        
+        temp_dir = None
         try:
             # Vaqtinchalik fayl nomi
             temp_dir = tempfile.mkdtemp()
@@ -253,6 +336,9 @@ async def download_video(url, quality='best'):
                 'embed_subs': False,
                 'writeinfojson': False,
                 'writethumbnail': False,
+                'progress_hooks': [_progress_hook],
+                # Osilib qolgan ulanishlar progress hook ga yetib borishi uchun
+                'socket_timeout': 30,
             }
             
             # Sifat sozlamalari (optimallashtirilgan)
@@ -269,7 +355,12 @@ async def download_video(url, quality='best'):
             ydl_opts['format'] = format_map.get(quality, 'best[filesize<100M]/best')
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+                # Extraction paytida progress hook chaqirilmaydi, shuning uchun
+                # yuklab olishdan oldin bekor qilinganini yana tekshiramiz
+                info = ydl.extract_info(url, download=False)
+                if job is not None and job['abort'].is_set():
+                    raise yt_dlp.utils.DownloadCancelled(job['reason'])
+                info = ydl.process_ie_result(info, download=True)
                 filename = ydl.prepare_filename(info)
                 
                 return {
@@ -281,6 +372,13 @@ async def download_video(url, quality='best'):
                 }
                 
         except Exception as e:
+            # Qisman yuklangan fayllarni tozalash
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            
+            if job is not None and job['abort'].is_set():
+                return _aborted_result()
+            
             return {
                 'success': False,
                 'error': str(e)[:100] + '...' if len(str(e)) > 100 else str(e)
@@ -288,8 +386,57 @@ async def download_video(url, quality='best'):
     
     # Thread pool da yuklab olish
     loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(executor, _download)
-    return result
+    download_future = executor.submit(_download)
+    future = asyncio.wrap_future(download_future)
+    
+    if job is None:
+        return await future
+    
+    # Yuklab olish, bekor qilish yoki muddat tugashini kutish.
+    # Job navbatda turganda muddat yo'q - slot olgach hisoblanadi.
+    waiters = {
+        asyncio.ensure_future(job['wakeup'].wait()),
+        asyncio.ensure_future(job['started'].wait())
+    }
+    try:
+        while not future.done() and not job['abort'].is_set():
+            timeout = None
+            if job['deadline'] is not None:
+                timeout = job['deadline'] - time.monotonic()
+                if timeout <= 0:
+                    break
+            
+            await asyncio.wait(
+                {future, *waiters},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            waiters = {waiter for waiter in waiters if not waiter.done()}
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+    
+    if future.done():
+        return future.result()
+    
+    # Thread hali ishlayapti yoki navbatda: uni to'xtatamiz va natijasini
+    # kutmaymiz. Navbatdagi job darhol olib tashlanadi, ishlayotgani esa
+    # yt-dlp keyingi progress hook da to'xtashi bilan slotni bo'shatadi.
+    abort_download(job, 'timeout')
+    
+    if download_future.cancel():
+        return _aborted_result()
+    
+    def _cleanup_late_result(done_future):
+        # To'xtatishdan oldin tugab qolgan yuklab olishni tozalash
+        if not done_future.cancelled() and done_future.exception() is None:
+            late_result = done_future.result()
+            if late_result.get('temp_dir'):
+                shutil.rmtree(late_result['temp_dir'], ignore_errors=True)
+    
+    download_future.add_done_callback(_cleanup_late_result)
+    
+    return _aborted_result()
 
 # Xabar handler (optimallashtirilgan)
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -378,26 +525,56 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.answer("❌ Siz hali barcha kanallarga obuna bo'lmadingiz!", show_alert=True)
         return
     
+    if query.data.startswith("cancel_"):
+        job = active_downloads.get(query.data[len("cancel_"):])
+        
+        # Faqat yuklab olishni boshlagan foydalanuvchi bekor qila oladi
+        if job and job['user_id'] == query.from_user.id:
+            abort_download(job, 'cancelled')
+        return
+    
     if query.data.startswith("dl_"):
         parts = query.data.split("_", 2)
         quality = parts[1]
         url = parts[2]
         
+        job_id = f"{query.message.chat_id}_{query.message.message_id}"
+        
+        # Tugma ikki marta bosilsa, shu xabar uchun ikkinchi yuklab olish boshlanmaydi
+        if job_id in active_downloads:
+            return
+        
+        timeout = get_download_timeout(detect_platform(url), quality)
+        job = create_download_job(job_id, query.from_user.id, timeout)
+        temp_dir = None
+        cancel_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("❌ Bekor qilish", callback_data=f"cancel_{job_id}")]
+        ])
+        
         # Yuklanish jarayoni haqida xabar
-        progress_message = await query.edit_message_text("⏳ Video yuklanmoqda... (3-5 soniya)")
+        try:
+            progress_message = await query.edit_message_text(
+                "⏳ Video yuklanmoqda... (3-5 soniya)",
+                reply_markup=cancel_keyboard
+            )
+        except Exception:
+            active_downloads.pop(job_id, None)
+            raise
         
         try:
             # Video yuklab olish
-            result = await download_video(url, quality)
+            result = await download_video(url, quality, job)
             
             if result['success']:
+                temp_dir = result['temp_dir']
+                
                 # Fayl yuborish
                 with open(result['filename'], 'rb') as video_file:
                     caption = f"🎬 {result['title']}\n📤 @{context.bot.username}"
                     
                     # Fayl hajmini tekshirish
                     file_size = os.path.getsize(result['filename'])
-                    if file_size > 50 * 1024 * 1024:  # 50MB
+                    if file_size > MAX_FILE_SIZE:
                         await progress_message.edit_text("❌ Fayl hajmi juda katta (50MB dan ortiq)")
                     else:
                         await context.bot.send_video(
@@ -408,17 +585,32 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         )
                         await progress_message.delete()
                 
-                # Vaqtinchalik fayllarni tozalash
-                shutil.rmtree(result['temp_dir'], ignore_errors=True)
-                
                 # Statistikani yangilash
                 await update_download_stats()
                 
+            elif result.get('reason') == 'cancelled':
+                download_counters['cancelled'] += 1
+                await progress_message.edit_text("🚫 Yuklab olish bekor qilindi")
+                
+            elif result.get('reason') == 'timeout':
+                download_counters['timed_out'] += 1
+                logger.info(f"Yuklab olish muddati tugadi ({timeout}s): {url}")
+                await progress_message.edit_text(f"⌛ Yuklab olish vaqti tugadi ({timeout} soniya)")
+                
+            elif result.get('reason') == 'too_large':
+                await progress_message.edit_text("❌ Fayl hajmi juda katta (50MB dan ortiq)")
+                
             else:
                 await progress_message.edit_text(f"❌ Xatolik: {result['error']}")
                 
         except Exception as e:
             await progress_message.edit_text(f"❌ Fayl yuborishda xatolik: {str(e)[:100]}")
+        finally:
+            # Vaqtinchalik fayllarni tozalash (yuborishda xatolik bo'lsa ham)
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            if active_downloads.get(job_id) is job:
+                active_downloads.pop(job_id)
 
 # Admin panel
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -489,9 +681,16 @@ def get_admin_stats():
 
 📊 Oxirgi 7 kun
 👥 Yangi: {week_stats[0] or 0}
-⬇️ Yuklab olingan: {week_stats[1] or 0}"""
+⬇️ Yuklab olingan: {week_stats[1] or 0}
+
+⏳ Ishga tushgandan beri
+🚫 Bekor qilingan: {download_counters['cancelled']}
+⌛ Vaqti tugagan: {download_counters['timed_out']}"""
     else:
-        return f"📊 Bot Statistikasi\n\n👥 Jami foydalanuvchilar: {total_users}\n📅 Bugun hali faoliyat bo'lmagan"
+        return (
+            f"📊 Bot Statistikasi\n\n👥 Jami foydalanuvchilar: {total_users}\n📅 Bugun hali faoliyat bo'lmagan\n\n"
+            f"🚫 Bekor qilingan: {download_counters['cancelled']}\n⌛ Vaqti tugagan: {download_counters['timed_out']}"
+        )
 
 # Xabar yuborish
 async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -622,7 +821,8 @@ async def main():
     init_database()
     
     # Bot yaratish - yangi usul
-    application = Application.builder().token("7626749090:AAFL--dyGniYyUVQ-U0sErxtwOL0qbrytXs").build()
+    # concurrent_updates: yuklab olish davomida "Bekor qilish" tugmasi ishlashi uchun
+    application = Application.builder().token("7626749090:AAFL--dyGniYyUVQ-U0sErxtwOL0qbrytXs").concurrent_updates(True).build()
     
     # Handlerlarni qo'shish
     application.add_handler(CommandHandler("start", start))